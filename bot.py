@@ -1,8 +1,16 @@
+import hashlib
+import hmac
 import logging
 import os
 import time
-from threading import Lock
-
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from queue import Queue
+from threading import Lock, Thread, local
+from types import MappingProxyType
+
+import orjson
 import shotgun_api3 as shotgun
 from dotenv import load_dotenv
 from flask import Flask, abort, request
@@ -18,10 +26,48 @@ if not slack_token:
     raise ValueError("SLACK_TOKEN is not set in the environment. Please check your .env file.")
 client = WebClient(token=slack_token)
 
-shotgrid_connection = shotgun.Shotgun(
-    "https://nfa.shotgunstudio.com", script_name="toSlack_export", api_key=os.getenv("SHOTGRID_API_KEY")
+shotgrid_webhook_secret = os.getenv("SHOTGRID_WEBHOOK_SECRET")
+if not shotgrid_webhook_secret:
+    logging.warning("SHOTGRID_WEBHOOK_SECRET is not set, webhook signatures will not be verified.")
+
+
+class ThreadLocalShotgun(local):
+    """Gives every thread its own persistent ShotGrid connection, as Shotgun instances are not thread-safe."""
+
+    def __init__(self):
+        self.connection = shotgun.Shotgun(
+            "https://nfa.shotgunstudio.com", script_name="toSlack_export", api_key=os.getenv("SHOTGRID_API_KEY")
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+shotgrid_connection = ThreadLocalShotgun()
+
+
+STATUS_DESCRIPTIONS = MappingProxyType(
+    {
+        "wtg": "Waiting to Start",
+        "rdy": "Ready to Start",
+        "ip": "In Progress",
+        "qc": "Quality Control",
+        "hld": "On Hold",
+        "omt": "Omit",
+        "pla": "Plate",
+        "ia": "Internally Approved",
+        "extrev": "Pending External Review",
+        "nupt": "New update",
+        "lib": "Library",
+        "prop": "Proposed Final",
+        "rfd": "Ready for Delivery",
+        "fin": "Final",
+        "rev": "Pending Review",
+        "rc": "Requires Changes",
+    }
 )
 
+
 # =============================================================
 """LET OP WERKT NIET GEBRUIK v27"""
 # =============================================================
@@ -31,70 +77,193 @@ class Throttler:
     def __init__(self, max_calls, period):
         self.max_calls = max_calls
         self.period = period
-        self.calls = 0
+        self.calls = deque(maxlen=max_calls)
         self.lock = Lock()
-        self.last_reset = time.time()
 
     def throttle(self):
         with self.lock:
-            current_time = time.time()
-            if current_time - self.last_reset > self.period:
-                self.calls = 0
-                self.last_reset = current_time
-            if self.calls < self.max_calls:
-                self.calls += 1
+            current_time = time.monotonic()
+            if len(self.calls) < self.max_calls or current_time - self.calls[0] > self.period:
+                self.calls.append(current_time)
                 return True
             return False
 
 
-throttler = Throttler(max_calls=5, period=10)
+throttler = Throttler(max_calls=1, period=1)
 
 
-def send_slack_message(slack_user_id, text):
-    """Sends a Slack message to a specific user."""
-    try:
-        response = client.chat_postMessage(channel=slack_user_id, text=text)
-        logging.info(f"Message sent successfully at {response['ts']} to {slack_user_id}")
-    except SlackApiError as e:
-        logging.error(f"Error sending message: {e.response['error']}")
+class TTLCache:
+    def __init__(self, ttl, max_entries=10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (value, time.monotonic() + self.ttl)
 
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+shotgrid_email_cache = TTLCache(ttl=3600)
+slack_user_id_cache = TTLCache(ttl=3600)
+
+
+slack_message_queue = Queue()
+# Messages sent in the last few seconds, so identical messages to the same user are only sent once.
+recent_slack_messages = TTLCache(ttl=5, max_entries=4096)
+
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="webhook-worker")
+
+# Lookups memoized for the duration of the event being dispatched on the current thread.
+event_state = local()
 
-def get_shotgrid_user_email(user_id):
-    """Query ShotGrid for the user's email using their user_id."""
-    user = shotgrid_connection.find_one("HumanUser", [["id", "is", user_id]], ["email"])
-    if user and "email" in user:
-        return user["email"]
-    return None
+
+def send_slack_message(slack_user_id, text):
+    """Queues a Slack message for a specific user, to be sent by the Slack message worker."""
+    slack_message_queue.put((slack_user_id, text))
+
+
+def post_slack_message(slack_user_id, text):
+    """Sends a Slack message to a specific user, retrying it when Slack rate limits the call."""
+    while True:
+        try:
+            response = client.chat_postMessage(channel=slack_user_id, text=text)
+            recent_slack_messages.set((slack_user_id, text), True)
+            logging.info("Message sent successfully at %s to %s", response["ts"], slack_user_id)
+            return
+        except SlackApiError as e:
+            if e.response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                logging.error("Error sending message: %s", e.response["error"])
+                return
+            retry_after = int(e.response.headers.get("Retry-After", 1))
+            logging.warning("Rate limited by Slack, retrying message to %s in %ss", slack_user_id, retry_after)
+            time.sleep(retry_after)
+
+
+def slack_message_worker():
+    """Sends queued Slack messages one at a time, paced by the throttler."""
+    while True:
+        slack_user_id, text = slack_message_queue.get()
+        try:
+            if recent_slack_messages.get((slack_user_id, text)):
+                logging.info("Skipping duplicate message to %s", slack_user_id)
+                continue
+            while not throttler.throttle():
+                time.sleep(0.1)
+            post_slack_message(slack_user_id, text)
+        except Exception:
+            logging.exception("Error in Slack message worker")
+        finally:
+            slack_message_queue.task_done()
+
+
+Thread(target=slack_message_worker, name="slack-message-worker", daemon=True).start()
+
+
+def get_shotgrid_user_emails(user_ids):
+    """Query ShotGrid for the emails of several users in a single call, keyed by user_id."""
+    event_cache = getattr(event_state, "cache", {})
+    email_by_id = {}
+    missing_ids = []
+    for user_id in user_ids:
+        cache_key = ("HumanUser", user_id)
+        cached_email = event_cache.get(cache_key) or shotgrid_email_cache.get(user_id)
+        if cached_email:
+            email_by_id[user_id] = cached_email
+        elif cache_key not in event_cache:
+            missing_ids.append(user_id)
+
+    if missing_ids:
+        users = shotgrid_connection.find("HumanUser", [["id", "in", missing_ids]], ["id", "email"])
+        for user in users:
+            if user.get("email"):
+                shotgrid_email_cache.set(user["id"], user["email"])
+                email_by_id[user["id"]] = user["email"]
+
+    for user_id in missing_ids:
+        event_cache[("HumanUser", user_id)] = email_by_id.get(user_id)
+
+    return email_by_id
+
+
+slack_user_ids_by_email = {}
+SLACK_DIRECTORY_REFRESH_INTERVAL = 15 * 60
+
+
+def refresh_slack_user_directory():
+    """Index every Slack workspace user by email address using the paginated users.list API."""
+    global slack_user_ids_by_email  # noqa: PLW0603
+
+    user_ids_by_email = {}
+    for page in client.users_list(limit=1000):
+        for user in page["members"]:
+            email = user.get("profile", {}).get("email")
+            if email and not user.get("deleted"):
+                user_ids_by_email[email.lower()] = user["id"]
+
+    slack_user_ids_by_email = user_ids_by_email
+    logging.info("Indexed %s Slack users by email", len(user_ids_by_email))
+
+
+def slack_user_directory_worker():
+    """Keeps the Slack user directory up to date."""
+    while True:
+        try:
+            refresh_slack_user_directory()
+        except SlackApiError as e:
+            logging.error("Error listing Slack users: %s", e.response["error"])
+        except Exception:
+            logging.exception("Error in Slack user directory worker")
+        time.sleep(SLACK_DIRECTORY_REFRESH_INTERVAL)
+
+
+Thread(target=slack_user_directory_worker, name="slack-user-directory", daemon=True).start()
 
 
 def find_slack_user_by_email(email):
-    """Use Slack's API to find a Slack user by email address."""
+    """Find a Slack user by email address, in the Slack user directory first and through Slack's API on a miss."""
+    email_key = email.lower()
+    slack_user_id = slack_user_ids_by_email.get(email_key) or slack_user_id_cache.get(email_key)
+    if slack_user_id:
+        return slack_user_id
+
     try:
         response = client.users_lookupByEmail(email=email)
         slack_user_id = response["user"]["id"]
+        slack_user_id_cache.set(email_key, slack_user_id)
         return slack_user_id
     except SlackApiError as e:
-        logging.error(f"Error finding Slack user by email: {e.response['error']}")
+        logging.error("Error finding Slack user by email: %s", e.response["error"])
         return None
 
 
-def get_assigned_users_from_tasks(shot_id):
-    """Query ShotGrid for all tasks associated with a shot and return assigned users' email addresses,
-    along with shot, sequence, and project names."""
-    shot_details = shotgrid_connection.find_one(
-        "Shot", [["id", "is", shot_id]], ["code", "project.Project.name", "sg_sequence.Sequence.code"]
+def get_assigned_users_by_step(entity_type, entity_id):
+    """Query ShotGrid for all tasks linked to an entity and return assigned users' email addresses per pipeline step."""
+    tasks = shotgrid_connection.find(
+        "Task", [["entity", "is", {"type": entity_type, "id": entity_id}]], ["task_assignees", "step.Step.short_name"]
     )
 
-    if not shot_details:
-        logging.error(f"Could not retrieve shot details for Shot ID: {shot_id}")
-        return None, None, None, None
-
-    shot_name = shot_details.get("code", "Unknown Shot")
-    sequence_name = shot_details.get("sg_sequence.Sequence.code", "Unknown Sequence")
-    project_name = shot_details.get("project.Project.name", "Unknown Project")
-
-    tasks = shotgrid_connection.find(
-        "Task", [["entity", "is", {"type": "Shot", "id": shot_id}]], ["task_assignees", "step.Step.short_name"]
+    # ShotGrid does not return deep-linked fields through multi-entity fields such as task_assignees,
+    # so the emails are resolved with one batched HumanUser query instead.
+    email_by_id = get_shotgrid_user_emails(
+        {assignee["id"] for task in tasks for assignee in task.get("task_assignees") or []}
     )
 
     assigned_users = {}
@@ -104,13 +273,32 @@ def get_assigned_users_from_tasks(shot_id):
 
         if task_assignees:
             for assignee in task_assignees:
-                user_data = shotgrid_connection.find_one("HumanUser", [["id", "is", assignee["id"]]], ["email"])
-                if user_data:
-                    user_email = user_data["email"]
+                user_email = email_by_id.get(assignee["id"])
+                if user_email:
                     if pipeline_step not in assigned_users:
                         assigned_users[pipeline_step] = []
                     assigned_users[pipeline_step].append(user_email)
 
+    return assigned_users
+
+
+def get_assigned_users_from_tasks(shot_id):
+    """Query ShotGrid for all tasks associated with a shot and return assigned users' email addresses,
+    along with shot, sequence, and project names."""
+    shot_details = shotgrid_connection.find_one(
+        "Shot", [["id", "is", shot_id]], ["code", "project.Project.name", "sg_sequence.Sequence.code"]
+    )
+
+    if not shot_details:
+        logging.error("Could not retrieve shot details for Shot ID: %s", shot_id)
+        return None, None, None, None
+
+    shot_name = shot_details.get("code", "Unknown Shot")
+    sequence_name = shot_details.get("sg_sequence.Sequence.code", "Unknown Sequence")
+    project_name = shot_details.get("project.Project.name", "Unknown Project")
+
+    assigned_users = get_assigned_users_by_step("Shot", shot_id)
+
     return assigned_users, shot_name, sequence_name, project_name
 
 
@@ -120,29 +308,13 @@ def get_assigned_users_from_asset_tasks(asset_id):
     asset_details = shotgrid_connection.find_one("Asset", [["id", "is", asset_id]], ["code", "project.Project.name"])
 
     if not asset_details:
-        logging.error(f"Could not retrieve asset details for Asset ID: {asset_id}")
+        logging.error("Could not retrieve asset details for Asset ID: %s", asset_id)
         return None, None, None
 
     asset_name = asset_details.get("code", "Unknown Asset")
     project_name = asset_details.get("project.Project.name", "Unknown Project")
 
-    tasks = shotgrid_connection.find(
-        "Task", [["entity", "is", {"type": "Asset", "id": asset_id}]], ["task_assignees", "step.Step.short_name"]
-    )
-
-    assigned_users = {}
-    for task in tasks:
-        task_assignees = task.get("task_assignees", [])
-        pipeline_step = task.get("step.Step.short_name", "Unknown Step")
-
-        if task_assignees:
-            for assignee in task_assignees:
-                user_data = shotgrid_connection.find_one("HumanUser", [["id", "is", assignee["id"]]], ["email"])
-                if user_data:
-                    user_email = user_data["email"]
-                    if pipeline_step not in assigned_users:
-                        assigned_users[pipeline_step] = []
-                    assigned_users[pipeline_step].append(user_email)
+    assigned_users = get_assigned_users_by_step("Asset", asset_id)
 
     return assigned_users, asset_name, project_name
 
@@ -152,26 +324,26 @@ def get_assigned_users_from_version_tasks(version_id):
     and return assigned users' email addresses, along with version and project names."""
 
     version_details = shotgrid_connection.find_one(
-        "Version", [["id", "is", version_id]], ["code", "project.Project.name", "sg_shot.Shot.code"]
+        "Version", [["id", "is", version_id]], ["code", "project.Project.name", "sg_shot.Shot.id"]
     )
 
     if not version_details:
-        logging.error(f"Could not retrieve version details for Version ID: {version_id}")
+        logging.error("Could not retrieve version details for Version ID: %s", version_id)
         return None, None, None
 
     version_name = version_details.get("code", "Unknown Version")
     project_name = version_details.get("project.Project.name", "Unknown Project")
 
-    shot_id = version_details.get("sg_shot.Shot.code")
+    shot_id = version_details.get("sg_shot.Shot.id")
 
     if not shot_id:
-        logging.warning(f"No shot linked to Version ID: {version_id}")
+        logging.warning("No shot linked to Version ID: %s", version_id)
         return {}, version_name, project_name
 
-    assigned_users_by_step, shot_name, sequence_name, project_name = get_assigned_users_from_tasks(shot_id)
+    assigned_users_by_step = get_assigned_users_by_step("Shot", shot_id)
 
     if not assigned_users_by_step:
-        logging.warning(f"No assigned users found for Shot ID: {shot_id}")
+        logging.warning("No assigned users found for Shot ID: %s", shot_id)
         return {}, version_name, project_name
 
     return assigned_users_by_step, version_name, project_name
@@ -197,7 +369,7 @@ def get_attachments_ids_from_note_id(node_id: int) -> list:
     note = shotgrid_connection.find_one("Note", filters, fields)
 
     if not note or "attachments" not in note:
-        logging.warning(f"No attachments found for Note ID: {node_id}")
+        logging.warning("No attachments found for Note ID: %s", node_id)
         return []
 
     attachment_ids = [attachment["id"] for attachment in note["attachments"]]
@@ -205,78 +377,103 @@ def get_attachments_ids_from_note_id(node_id: int) -> list:
     return attachment_ids
 
 
-def get_file_url_from_attachment_id(attachment_id: int) -> str:
-    """Searches ShotGrid database for attachment that matches attachment ID and returns its file path.
+def get_file_urls_from_attachment_ids(attachment_ids: list) -> dict:
+    """Searches ShotGrid database for attachments that match the attachment IDs in a single query.
 
     Args:
-        attachment_id: The ID of the attachment to search for.
+        attachment_ids: The IDs of the attachments to search for.
 
     Returns:
-        The file URL of the attachment, or an empty string if not found.
+        A dictionary mapping attachment IDs to their file URLs, leaving out attachments without a file.
     """
+    if not attachment_ids:
+        return {}
+
     filters = [
         [
             "id",
-            "is",
-            attachment_id,
+            "in",
+            list(attachment_ids),
         ]
     ]
-    fields = ["this_file"]
-    attachment = shotgrid_connection.find_one("Attachment", filters, fields)
+    fields = ["id", "this_file"]
+    attachments = shotgrid_connection.find("Attachment", filters, fields)
 
-    if attachment and "this_file" in attachment:
-        return attachment["this_file"]["url"]
+    file_urls = {}
+    for attachment in attachments:
+        file_url = (attachment.get("this_file") or {}).get("url")
+        if file_url:
+            file_urls[attachment["id"]] = file_url
 
-    logging.warning(f"Attachment ID {attachment_id} not found.")
-    return ""
+    return file_urls
 
 
 def send_message_to_assigned_users(assigned_users_by_step, shot_name, sequence_name, project_name, message_content):
     """Send a Slack message to each assigned user found in the ShotGrid tasks, including shot, sequence, and project details."""
+    notified_emails = set()
     for step, users in assigned_users_by_step.items():
+        prefix = f"In {project_name}|{sequence_name}|{shot_name}|{step}\n"
         for email in users:
+            if email in notified_emails:
+                continue
+            notified_emails.add(email)
+
             slack_user_id = find_slack_user_by_email(email)
             if slack_user_id:
-                try:
-                    personalized_message = (
-                        f"In {project_name}|{sequence_name}|{shot_name}|{step}\n" f"{message_content}"
-                    )
-                    send_slack_message(slack_user_id, personalized_message)
-                    logging.info(f"Message sent to {email} (Slack ID: {slack_user_id}) for step {step}")
-                except SlackApiError as e:
-                    logging.error(f"Error sending message to {email}: {e.response['error']}")
+                send_slack_message(slack_user_id, prefix + message_content)
+                logging.info("Message queued for %s (Slack ID: %s) for step %s", email, slack_user_id, step)
             else:
-                logging.warning(f"Could not find Slack user for email: {email}")
+                logging.warning("Could not find Slack user for email: %s", email)
+
+
+def dispatch(event_data):
+    """Route a ShotGrid event to the handler for its entity type and event."""
+    event_state.cache = {}
+    try:
+        entity_type = event_data.get("meta", {}).get("entity_type")
+        operation = event_data.get("operation")
+        event_type = event_data.get("event_type")
+
+        handler = HANDLERS.get((entity_type, event_type, operation))
+        if handler:
+            handler(event_data)
+        else:
+            logging.warning("Unsupported entity type or event: %s, %s", entity_type, event_type)
+
+    except Exception:
+        logging.exception("Error processing the event")
+    finally:
+        del event_state.cache
+
+
+def is_valid_webhook_signature(body, signature):
+    """Check the ShotGrid webhook signature, an HMAC-SHA1 of the request body keyed with the webhook secret token.
+
+    Every request is accepted when no secret token is configured.
+    """
+    if not shotgrid_webhook_secret:
+        return True
+    expected_signature = "sha1=" + hmac.new(shotgrid_webhook_secret.encode(), body, hashlib.sha1).hexdigest()
+    return hmac.compare_digest(expected_signature.encode(), signature.encode("latin-1"))
 
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
     if request.method == "POST":
-        if request.json:
-            print("Received JSON data:")
-            print(request.json)
-
-            try:
-                event_data = request.json.get("data", {})
-                entity_type = event_data.get("meta", {}).get("entity_type")
-                entity_id = event_data.get("meta", {}).get("entity_id")
-                operation = event_data.get("operation")
-                event_type = event_data.get("event_type")
-
-                if entity_type == "Shot":
-                    return handle_shot_event(event_data)
-                if entity_type == "Note" and event_type == "Shotgun_Note_New" and operation == "create":
-                    return handle_note_event(event_data)
-                if entity_type == "Reply" and event_type == "Shotgun_Reply_New" and operation == "create":
-                    return handle_reply_event(event_data)
-                if entity_type == "Task" and event_type == "Shotgun_Task_Change" and operation == "update":
-                    return handle_task_assignment_event(event_data)
-                logging.warning(f"Unsupported entity type or event: {entity_type}, {event_type}")
-                return "Entity type or event not supported", 400
-
-            except Exception as e:
-                logging.error(f"Error processing the request: {e!s}")
-                return "Error processing data", 500
+        if not is_valid_webhook_signature(request.get_data(), request.headers.get("X-SG-SIGNATURE", "")):
+            logging.warning("Rejected webhook with a missing or invalid signature.")
+            return "Invalid signature", 401
+
+        try:
+            payload = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            payload = None
+
+        if payload and isinstance(payload, dict):
+            logging.debug("Received JSON data: %s", payload)
+
+            executor.submit(dispatch, payload.get("data", {}))
+            return "", 202
         else:
             logging.error("No JSON received or invalid data.")
             return "Invalid data format", 400
@@ -284,23 +481,6 @@ def webhook():
         abort(400)
 
 
-STATUS_DESCRIPTIONS = {
-    "wtg": "Waiting to Start",
-    "rdy": "Ready to Start",
-    "ip": "In Progress",
-    "qc": "Quality Control",
-    "hld": "On Hold",
-    "omt": "Omit",
-    "pla": "Plate",
-    "extrev": "Pending External Review",
-    "prop": "Proposed Final",
-    "rfd": "Ready for Delivery",
-    "fin": "Final",
-    "rev": "Pending Review",
-    "rc": "Requires Changes",
-}
-
-
 def handle_shot_event(event_data):
     """Process Shot-related events."""
     entity_id = event_data.get("meta", {}).get("entity_id")
@@ -316,29 +496,29 @@ def handle_shot_event(event_data):
     assigned_users_by_step, shot_name, sequence_name, project_name = get_assigned_users_from_tasks(entity_id)
 
     if assigned_users_by_step:
-        for step, users in assigned_users_by_step.items():
-            personalized_message = f"{message_content}"
-            send_message_to_assigned_users({step: users}, shot_name, sequence_name, project_name, personalized_message)
+        send_message_to_assigned_users(assigned_users_by_step, shot_name, sequence_name, project_name, message_content)
+
+        return
+    logging.warning("No assigned users found for Shot ID: %s", entity_id)
+
 
-        return "success", 200
-    logging.warning(f"No assigned users found for Shot ID: {entity_id}")
-    return "No assigned users found", 404
+ATTACHMENT_POLL_DELAYS = (0.1, 0.25, 0.5, 1.0, 1.5)
 
 
 def handle_note_event(event_data):
     """Process Note-related events."""
     note_id = event_data.get("meta", {}).get("entity_id")
-    logging.info(f"New note created with ID: {note_id}")
+    logging.info("New note created with ID: %s", note_id)
 
     note_details = shotgrid_connection.find_one(
         "Note",
         [["id", "is", note_id]],
-        ["content", "note_links", "created_by.HumanUser.email", "created_by.HumanUser.name"],
+        ["content", "note_links", "attachments", "created_by.HumanUser.email", "created_by.HumanUser.name"],
     )
 
     if not note_details:
-        logging.error(f"Could not retrieve details for Note ID: {note_id}")
-        return "Note details not found", 404
+        logging.error("Could not retrieve details for Note ID: %s", note_id)
+        return
 
     note_content = note_details.get("content", "No content")
     note_links = note_details.get("note_links", [])
@@ -346,8 +526,8 @@ def handle_note_event(event_data):
     created_by_name = note_details.get("created_by.HumanUser.name", "unknown user")
 
     if not note_links:
-        logging.warning(f"No linked entities found for Note ID: {note_id}")
-        return "No linked entities found", 404
+        logging.warning("No linked entities found for Note ID: %s", note_id)
+        return
 
     linked_entity = note_links[0]
     linked_entity_type = linked_entity["type"]
@@ -355,15 +535,20 @@ def handle_note_event(event_data):
 
     message_content = f"{created_by_name} added a note:\n{note_content}"
 
-    time.sleep(3)
+    # Attachments can land shortly after the note is created, so poll for them with a growing delay.
+    attachment_ids = [attachment["id"] for attachment in note_details.get("attachments") or []]
+    for delay in ATTACHMENT_POLL_DELAYS:
+        if attachment_ids:
+            break
+        time.sleep(delay)
+        attachment_ids = get_attachments_ids_from_note_id(note_id)
 
-    attachment_ids = get_attachments_ids_from_note_id(note_id)
+    file_urls = get_file_urls_from_attachment_ids(attachment_ids)
     annotated_frame_url = ""
 
     for attachment_id in attachment_ids:
-        file_url = get_file_url_from_attachment_id(attachment_id)
-        if file_url:
-            annotated_frame_url = file_url
+        if attachment_id in file_urls:
+            annotated_frame_url = file_urls[attachment_id]
             break
 
     if annotated_frame_url:
@@ -372,20 +557,20 @@ def handle_note_event(event_data):
     if linked_entity_type == "Shot":
         assigned_users_by_step, shot_name, sequence_name, project_name = get_assigned_users_from_tasks(linked_entity_id)
         if assigned_users_by_step:
-            for step, users in assigned_users_by_step.items():
-                send_message_to_assigned_users({step: users}, shot_name, sequence_name, project_name, message_content)
-            return "success", 200
-        logging.warning(f"No assigned users found for linked Shot ID: {linked_entity_id}")
-        return "No assigned users found for linked Shot", 404
+            send_message_to_assigned_users(
+                assigned_users_by_step, shot_name, sequence_name, project_name, message_content
+            )
+            return
+        logging.warning("No assigned users found for linked Shot ID: %s", linked_entity_id)
+        return
 
     if linked_entity_type == "Asset":
         assigned_users_by_step, asset_name, project_name = get_assigned_users_from_asset_tasks(linked_entity_id)
         if assigned_users_by_step:
-            for step, users in assigned_users_by_step.items():
-                send_message_to_assigned_users({step: users}, asset_name, "N/A", project_name, message_content)
-            return "success", 200
-        logging.warning(f"No assigned users found for linked Asset ID: {linked_entity_id}")
-        return "No assigned users found for linked Asset", 404
+            send_message_to_assigned_users(assigned_users_by_step, asset_name, "N/A", project_name, message_content)
+            return
+        logging.warning("No assigned users found for linked Asset ID: %s", linked_entity_id)
+        return
 
     if (
         linked_entity_type == "Version"
@@ -394,14 +579,12 @@ def handle_note_event(event_data):
     ):
         assigned_users_by_step, version_name, project_name = get_assigned_users_from_version_tasks(linked_entity_id)
         if assigned_users_by_step:
-            for step, users in assigned_users_by_step.items():
-                send_message_to_assigned_users({step: users}, version_name, "N/A", project_name, message_content)
-            return "success", 200
-        logging.warning(f"No assigned users found for linked Version ID: {linked_entity_id}")
-        return "No assigned users found for linked Version", 404
+            send_message_to_assigned_users(assigned_users_by_step, version_name, "N/A", project_name, message_content)
+            return
+        logging.warning("No assigned users found for linked Version ID: %s", linked_entity_id)
+        return
 
-    logging.warning(f"Unsupported linked entity type: {linked_entity_type} for Note ID: {note_id}")
-    return "Unsupported linked entity type", 400
+    logging.warning("Unsupported linked entity type: %s for Note ID: %s", linked_entity_type, note_id)
 
 
 def handle_task_assignment_event(event_data):
@@ -410,33 +593,40 @@ def handle_task_assignment_event(event_data):
     attribute_name = event_data.get("meta", {}).get("attribute_name")
 
     if attribute_name != "task_assignees":
-        logging.info(f"Change in Task ID {entity_id} is not related to task assignments.")
-        return "Not a task assignment event", 200
+        logging.info("Change in Task ID %s is not related to task assignments.", entity_id)
+        return
 
     added_assignees = event_data.get("meta", {}).get("added", [])
     removed_assignees = event_data.get("meta", {}).get("removed", [])
 
-    task_details = shotgrid_connection.find_one("Task", [["id", "is", entity_id]], ["entity", "step.Step.short_name"])
+    task_details = shotgrid_connection.find_one(
+        "Task",
+        [["id", "is", entity_id]],
+        [
+            "entity",
+            "entity.Shot.code",
+            "entity.Shot.project.Project.name",
+            "entity.Shot.sg_sequence.Sequence.code",
+            "step.Step.short_name",
+        ],
+    )
 
     if not task_details:
-        logging.error(f"Could not retrieve details for Task ID: {entity_id}")
-        return "Task details not found", 404
+        logging.error("Could not retrieve details for Task ID: %s", entity_id)
+        return
 
     linked_shot = task_details.get("entity")
     step_name = task_details.get("step.Step.short_name", "Unknown Step")
 
     if linked_shot and linked_shot["type"] == "Shot":
-        shot_id = linked_shot["id"]
-        shot_name = linked_shot["name"]
+        shot_name = task_details.get("entity.Shot.code") or linked_shot["name"]
+        project_name = task_details.get("entity.Shot.project.Project.name", "Unknown Project")
+        sequence_name = task_details.get("entity.Shot.sg_sequence.Sequence.code", "Unknown Sequence")
 
-        shot_details = shotgrid_connection.find_one(
-            "Shot", [["id", "is", shot_id]], ["project.Project.name", "sg_sequence.Sequence.code"]
-        )
-        project_name = shot_details.get("project.Project.name", "Unknown Project")
-        sequence_name = shot_details.get("sg_sequence.Sequence.code", "Unknown Sequence")
+        email_by_id = get_shotgrid_user_emails({assignee["id"] for assignee in added_assignees + removed_assignees})
 
         for assignee in added_assignees:
-            user_email = get_shotgrid_user_email(assignee["id"])
+            user_email = email_by_id.get(assignee["id"])
             if user_email:
                 slack_user_id = find_slack_user_by_email(user_email)
                 if slack_user_id:
@@ -446,10 +636,10 @@ def handle_task_assignment_event(event_data):
                     )
                     send_slack_message(slack_user_id, message_content)
                 else:
-                    logging.warning(f"Slack user not found for email: {user_email}")
+                    logging.warning("Slack user not found for email: %s", user_email)
 
         for removed_assignee in removed_assignees:
-            user_email = get_shotgrid_user_email(removed_assignee["id"])
+            user_email = email_by_id.get(removed_assignee["id"])
             if user_email:
                 slack_user_id = find_slack_user_by_email(user_email)
                 if slack_user_id:
@@ -459,29 +649,9 @@ def handle_task_assignment_event(event_data):
                     )
                     send_slack_message(slack_user_id, message_content)
                 else:
-                    logging.warning(f"Slack user not found for email: {user_email}")
+                    logging.warning("Slack user not found for email: %s", user_email)
     else:
-        logging.info(f"Task {entity_id} is not linked to a Shot.")
-        return "Not linked to a Shot", 200
-
-    return "success", 200
-
-
-STATUS_DESCRIPTIONS = {
-    "wtg": "Waiting to Start",
-    "rdy": "Ready to Start",
-    "ip": "In Progress",
-    "hld": "On Hold",
-    "omt": "Omit",
-    "ia": "Internally Approved",
-    "rev": "Pending Review",
-    "nupt": "New update",
-    "rc": "Requires Changes",
-    "lib": "Library",
-    "prop": "Proposed Final",
-    "qc": "Quality Control",
-    "fin": "Final",
-}
+        logging.info("Task %s is not linked to a Shot.", entity_id)
 
 
 def handle_asset_event(event_data):
@@ -499,20 +669,32 @@ def handle_asset_event(event_data):
     assigned_users_by_step, asset_name, project_name = get_assigned_users_from_asset_tasks(entity_id)
 
     if assigned_users_by_step:
-        for step, users in assigned_users_by_step.items():
-            personalized_message = f"{message_content}"
-            send_message_to_assigned_users({step: users}, asset_name, "N/A", project_name, personalized_message)
+        send_message_to_assigned_users(assigned_users_by_step, asset_name, "N/A", project_name, message_content)
 
-        logging.info(f"Notification sent for Asset ID: {entity_id}")
-        return "success", 200
-    logging.warning(f"No assigned users found for Asset ID: {entity_id}")
-    return "No assigned users found", 404
+        logging.info("Notification sent for Asset ID: %s", entity_id)
+        return
+    logging.warning("No assigned users found for Asset ID: %s", entity_id)
+
+
+def handle_human_user_event(event_data):
+    """Drop cached lookups for a HumanUser whose details changed."""
+    user_id = event_data.get("meta", {}).get("entity_id")
+    attribute_name = event_data.get("meta", {}).get("attribute_name")
+
+    shotgrid_email_cache.pop(user_id)
+    if attribute_name == "email":
+        old_email = event_data.get("meta", {}).get("old_value")
+        if old_email:
+            slack_user_ids_by_email.pop(old_email.lower(), None)
+            slack_user_id_cache.pop(old_email.lower())
+
+    logging.info("Cleared cached lookups for HumanUser ID: %s", user_id)
 
 
 def handle_reply_event(event_data):
     """Process Reply-related events."""
     reply_id = event_data.get("meta", {}).get("entity_id")
-    logging.info(f"New reply created with ID: {reply_id}")
+    logging.info("New reply created with ID: %s", reply_id)
 
     reply_details = shotgrid_connection.find_one(
         "Reply",
@@ -521,8 +703,8 @@ def handle_reply_event(event_data):
     )
 
     if not reply_details:
-        logging.error(f"Could not retrieve details for Reply ID: {reply_id}")
-        return "Reply details not found", 404
+        logging.error("Could not retrieve details for Reply ID: %s", reply_id)
+        return
 
     reply_content = reply_details.get("content", "No content")
     note_content = reply_details.get("note.Note.content", "No associated note content")
@@ -546,17 +728,27 @@ def handle_reply_event(event_data):
                 send_message_to_assigned_users(
                     assigned_users_by_step, shot_name, sequence_name, project_name, message_content
                 )
-                return "success", 200
-            logging.warning(f"No assigned users found for linked Shot ID: {linked_shot_id}")
-            return "No assigned users found for linked entity", 404
+                return
+            logging.warning("No assigned users found for linked Shot ID: %s", linked_shot_id)
+            return
 
     if slack_user_id:
         message_content = f"A new Reply has been created by you:\n{reply_content}\n" f"Related Note: {note_content}"
         send_slack_message(slack_user_id, message_content)
-        return "success", 200
-    logging.warning(f"No linked entities or Slack user found for Reply ID: {reply_id}")
-    return "No users found for notification", 404
+        return
+    logging.warning("No linked entities or Slack user found for Reply ID: %s", reply_id)
+
+
+HANDLERS = {
+    ("Shot", "Shotgun_Shot_Change", "update"): handle_shot_event,
+    ("Note", "Shotgun_Note_New", "create"): handle_note_event,
+    ("Reply", "Shotgun_Reply_New", "create"): handle_reply_event,
+    ("Task", "Shotgun_Task_Change", "update"): handle_task_assignment_event,
+    ("HumanUser", "Shotgun_HumanUser_Change", "update"): handle_human_user_event,
+}
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=19132, debug=True)
+    from waitress import serve
+
+    serve(app, host="0.0.0.0", port=19132, threads=32)